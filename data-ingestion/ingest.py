@@ -8,15 +8,24 @@ This script will be responsible for the entire data ingestion pipeline:
 """
 import os
 import re
+import asyncio
+import bisect
+import itertools
+import mmap
+import shutil
 import requests
-import pdfplumber
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import pymupdf
 from dotenv import load_dotenv
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple
 from tqdm import tqdm
 import openai
-from pinecone import Pinecone
-import time
-import hashlib
+import tiktoken
+from pinecone import Pinecone, ServerlessSpec
+from blake3 import blake3
+from tenacity import RetryCallState, retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # --- CONFIGURATION ---
 load_dotenv()
@@ -40,21 +49,173 @@ TEXTBOOK_URLS = {
 BASE_DIR = "scraped_data"
 PDF_DIR = os.path.join(BASE_DIR, "pdfs")
 
+# PDF content hashes, used to skip extraction only for an unchanged PDF
+HASH_SUFFIX = ".blake3"  # Sidecar next to each PDF and each extracted text file
+HASH_BLOCK_SIZE = 1024 * 1024  # Bytes per read when hashing PDFs
+
 # API Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = "k12-math-textbooks"
+PINECONE_CLOUD = os.getenv("PINECONE_CLOUD", "aws")
+PINECONE_REGION = os.getenv("PINECONE_REGION", "us-east-1")
 
 # Chunking Configuration
-CHUNK_SIZE = 1000  # Target characters per chunk
-CHUNK_OVERLAP = 200  # Overlap between chunks to maintain context
-MIN_CHUNK_SIZE = 300  # Minimum size for a chunk to be useful
+CHUNK_TOKENS = 512  # Tokens per chunk window
+CHUNK_OVERLAP_TOKENS = 100  # Tokens shared with the previous window to maintain context
+
+# Embedding Configuration
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 768  # Shortened from the model's native 1536 dimensions
+EMBEDDING_MAX_TOKENS = 8000  # Per-input limit, with some buffer below 8192
+EMBEDDING_BATCH_TOKEN_BUDGET = 250000  # Per-request limit is 300k tokens
+EMBEDDING_BATCH_SIZE = 100  # Chunks per request, so embedding overlaps chunking
+PINECONE_BATCH_SIZE = 100
+
+# Tokenizer matching the embedding model, for exact token counts
+_ENC = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+# Concurrency Configuration
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # Bytes per read when saving PDFs
+UPSERT_WORKERS = 4  # Pinecone client threads for async upserts
+EXTRACT_WORKERS = os.cpu_count() or 1  # Processes extracting PDF page ranges
+EXTRACT_RANGE_PAGES = 50  # Maximum pages per extraction range
+EMBEDDING_CONCURRENCY = 8  # Embedding requests in flight at once
+EMBEDDING_MAX_RETRIES = 6  # Attempts per request when rate limited
+
+# Text cleaning patterns, compiled once at import
+_WS_RE = re.compile(r'\s+')
+_URL_RE = re.compile(r'http[s]?://\S+')
+_EMAIL_RE = re.compile(r'\S+@\S+')
+
+# Smart quotes, backticks and long dashes normalized to ASCII in one pass
+_NORMALIZE_TABLE = str.maketrans({
+    '\u201c': '"', '\u201d': '"',              # “ ”
+    '\u2018': "'", '\u2019': "'", '`': "'",     # ‘ ’ `
+    '\u2014': '-', '\u2013': '-',              # — –
+})
+
+# Chapter/section header lines, for chunk metadata. Numbered sections look like
+# "1.1 Introduction to Whole Numbers"; exercises like "3. Divide" do not count.
+_HEADER_RE = re.compile(r'^(?:(?P<chapter>chapter \d+)\b|section\b|\d+\.\d+ (?-i:[A-Z]))', re.IGNORECASE)
+# Numbered exercises and answers ("3. Divide", "282. 86°F"), never headers
+_EXERCISE_RE = re.compile(r'\d+\. ')
+# Running page headers and contents entries, which end with a page number
+_PAGE_SUFFIX_RE = re.compile(r'(?P<title>(?:chapter \d+|\d+\.\d+) .*\D) \d+', re.IGNORECASE)
+
+# Shared HTTP session so connections are reused across downloads
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5),
+))
+
+# Shared OpenAI client for all embedding requests. Its connection pool is bound
+# to the event loop it first runs on, so every book reuses the same loop.
+# SDK retries are disabled so _request_embeddings is the only retry layer.
+_OPENAI_CLIENT = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0) if OPENAI_API_KEY else None
+_EVENT_LOOP = asyncio.new_event_loop()
+
+# Shared Pinecone index handle, connected on first use
+_PINECONE_INDEX = None
+
+def get_pinecone_index():
+    """
+    Return the shared Pinecone index handle, connecting on first use.
+    
+    The index is created if it doesn't exist yet.
+    
+    Returns:
+        Index: Pinecone index for PINECONE_INDEX_NAME
+    """
+    global _PINECONE_INDEX
+    if _PINECONE_INDEX is None:
+        print(f"🌲 Connecting to Pinecone...")
+        pc = Pinecone(api_key=PINECONE_API_KEY)
+        
+        # Create the index on first run, sized for the configured embeddings
+        if not pc.has_index(PINECONE_INDEX_NAME):
+            print(f"🌱 Creating Pinecone index {PINECONE_INDEX_NAME} ({EMBEDDING_DIMENSIONS} dimensions)...")
+            pc.create_index(
+                name=PINECONE_INDEX_NAME,
+                dimension=EMBEDDING_DIMENSIONS,
+                metric="cosine",
+                spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION)
+            )
+        
+        dimension = pc.describe_index(PINECONE_INDEX_NAME).dimension
+        if dimension != EMBEDDING_DIMENSIONS:
+            raise ValueError(
+                f"Index {PINECONE_INDEX_NAME} has {dimension} dimensions but embeddings have "
+                f"{EMBEDDING_DIMENSIONS}; delete the index so it can be recreated"
+            )
+        
+        _PINECONE_INDEX = pc.Index(PINECONE_INDEX_NAME, pool_threads=UPSERT_WORKERS)
+    return _PINECONE_INDEX
 
 def ensure_directories():
     """Create necessary directories if they don't exist."""
     os.makedirs(BASE_DIR, exist_ok=True)
     os.makedirs(PDF_DIR, exist_ok=True)
 
+def write_pdf_hash(pdf_path: str) -> str:
+    """
+    Hash a PDF's contents and store the digest in a sidecar file next to it.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        
+    Returns:
+        str: Hex digest identifying the PDF's contents
+    """
+    hasher = blake3()
+    with open(pdf_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+    
+    digest = hasher.hexdigest(length=8)
+    with open(pdf_path + HASH_SUFFIX, 'w', encoding='utf-8') as file:
+        file.write(digest)
+    return digest
+
+def read_pdf_hash(pdf_path: str) -> str:
+    """
+    Return a PDF's content hash, recomputing it if the sidecar is missing or stale.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        
+    Returns:
+        str: Hex digest identifying the PDF's contents
+    """
+    hash_path = pdf_path + HASH_SUFFIX
+    
+    # A sidecar older than the PDF may describe a previous download
+    if os.path.exists(hash_path) and os.path.getmtime(hash_path) >= os.path.getmtime(pdf_path):
+        with open(hash_path, 'r', encoding='utf-8') as file:
+            return file.read().strip()
+    
+    return write_pdf_hash(pdf_path)
+
+def read_text_source_hash(text_path: str) -> str:
+    """
+    Return the hash of the PDF a text file was extracted from, if recorded.
+    
+    Args:
+        text_path: Path to the extracted text file
+        
+    Returns:
+        str: Hex digest of the source PDF, or None if unknown
+    """
+    hash_path = text_path + HASH_SUFFIX
+    if not (os.path.exists(text_path) and os.path.exists(hash_path)):
+        return None
+    
+    with open(hash_path, 'r', encoding='utf-8') as file:
+        return file.read().strip()
+
 def download_pdf(book_name: str, url: str) -> bool:
     """
     Download a PDF file from the given URL.
@@ -75,21 +236,17 @@ def download_pdf(book_name: str, url: str) -> bool:
     
     try:
         print(f"📥 Downloading {book_name}...")
-        response = requests.get(url, stream=True, timeout=30)
+        response = SESSION.get(url, stream=True, timeout=30)
         response.raise_for_status()
         
-        total_size = int(response.headers.get('content-length', 0))
-        
+        # Copy the raw stream straight to disk in large blocks
+        response.raw.decode_content = True
         with open(pdf_path, 'wb') as file:
-            if total_size == 0:
-                file.write(response.content)
-            else:
-                downloaded = 0
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        file.write(chunk)
-                        downloaded += len(chunk)
-                        
+            shutil.copyfileobj(response.raw, file, length=DOWNLOAD_CHUNK_SIZE)
+        
+        # Record the content hash so extraction can tell this PDF apart
+        write_pdf_hash(pdf_path)
+        
         file_size = os.path.getsize(pdf_path)
         print(f"✅ Downloaded {book_name}: {file_size / (1024*1024):.1f} MB")
         return True
@@ -98,6 +255,35 @@ def download_pdf(book_name: str, url: str) -> bool:
         print(f"❌ Failed to download {book_name}: {str(e)}")
         return False
 
+def _extract_range(pdf_path: str, start: int, end: int) -> str:
+    """
+    Extract text from a contiguous range of PDF pages.
+    
+    Runs in a worker process, so a bad page only loses its own text.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        start: Index of the first page to extract
+        end: Index one past the last page to extract
+        
+    Returns:
+        str: Text of the non-empty pages in the range, separated by blank lines
+    """
+    text_content = []
+    
+    with pymupdf.open(pdf_path) as doc:
+        for page_index in range(start, end):
+            try:
+                page_text = doc[page_index].get_text("text")
+                if page_text:
+                    text_content.append(page_text)
+                    
+            except Exception as e:
+                print(f"  ⚠️  Error on page {page_index + 1}: {str(e)}")
+                continue
+    
+    return "\n\n".join(text_content)
+
 def extract_text_from_pdf(book_name: str) -> bool:
     """
     Extract text from a PDF file and save it to a text file.
@@ -111,11 +297,9 @@ def extract_text_from_pdf(book_name: str) -> bool:
     pdf_path = os.path.join(PDF_DIR, f"{book_name}.pdf")
     book_dir = os.path.join(BASE_DIR, book_name)
     text_path = os.path.join(book_dir, f"{book_name}_full_text.txt")
-    
-    # Skip if text file already exists
-    if os.path.exists(text_path):
-        print(f"✓ Text already extracted: {book_name}")
-        return True
+    # Extraction is written under a temporary name so an interrupted run isn't
+    # mistaken for a finished extraction
+    partial_path = text_path + ".partial"
     
     # Skip if PDF doesn't exist
     if not os.path.exists(pdf_path):
@@ -123,41 +307,55 @@ def extract_text_from_pdf(book_name: str) -> bool:
         return False
     
     try:
+        # Skip only if the text was extracted from this exact PDF, so a changed
+        # PDF is re-extracted
+        pdf_hash = read_pdf_hash(pdf_path)
+        if read_text_source_hash(text_path) == pdf_hash:
+            print(f"✓ Text already extracted: {book_name}")
+            return True
+        
         print(f"📄 Extracting text from {book_name}...")
         os.makedirs(book_dir, exist_ok=True)
         
-        text_content = []
-        
-        with pdfplumber.open(pdf_path) as pdf:
-            total_pages = len(pdf.pages)
-            
-            for page_num, page in enumerate(pdf.pages, 1):
-                try:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_content.append(page_text)
-                    
-                    # Progress indicator
-                    if page_num % 50 == 0 or page_num == total_pages:
-                        print(f"  📖 Processed {page_num}/{total_pages} pages")
-                        
-                except Exception as e:
-                    print(f"  ⚠️  Error on page {page_num}: {str(e)}")
-                    continue
+        with pymupdf.open(pdf_path) as doc:
+            total_pages = doc.page_count
+        
+        # Split pages into contiguous ranges, small enough that only a few
+        # ranges of text are held in memory before being written out
+        range_size = max(1, min(-(-total_pages // EXTRACT_WORKERS), EXTRACT_RANGE_PAGES))
+        starts = list(range(0, total_pages, range_size))
+        ends = [min(start + range_size, total_pages) for start in starts]
+        
+        # Stream ranges to disk as they arrive
+        char_count = 0
+        
+        with open(partial_path, 'w', encoding='utf-8') as file, \
+                ProcessPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+            # Results come back in page order
+            for end, range_text in zip(ends, executor.map(_extract_range, itertools.repeat(pdf_path), starts, ends)):
+                if range_text:
+                    if char_count:
+                        file.write("\n\n")
+                        char_count += 2
+                    file.write(range_text)
+                    char_count += len(range_text)
+                
+                # Progress indicator
+                print(f"  📖 Processed {end}/{total_pages} pages")
         
-        # Combine all text
-        full_text = "\n\n".join(text_content)
+        os.replace(partial_path, text_path)
         
-        # Save to file
-        with open(text_path, 'w', encoding='utf-8') as file:
-            file.write(full_text)
+        # Record which PDF this text came from
+        with open(text_path + HASH_SUFFIX, 'w', encoding='utf-8') as file:
+            file.write(pdf_hash)
         
-        char_count = len(full_text)
         print(f"✅ Extracted text from {book_name}: {char_count:,} characters ({total_pages} pages)")
         return True
         
     except Exception as e:
         print(f"❌ Failed to extract text from {book_name}: {str(e)}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return False
 
 def clean_text(text: str) -> str:
@@ -171,237 +369,327 @@ def clean_text(text: str) -> str:
         str: Cleaned text
     """
     # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Remove page numbers and headers/footers (common patterns)
-    text = re.sub(r'\n\d+\s*\n', '\n', text)
-    text = re.sub(r'\n\s*Page \d+\s*\n', '\n', text)
+    text = _WS_RE.sub(' ', text)
     
     # Remove URLs and email addresses
-    text = re.sub(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '', text)
-    text = re.sub(r'\S+@\S+', '', text)
+    text = _URL_RE.sub('', text)
+    text = _EMAIL_RE.sub('', text)
     
-    # Normalize quotes and dashes
-    text = re.sub(r'[""]', '"', text)
-    text = re.sub(r'[''`]', "'", text)
-    text = re.sub(r'[—–]', '-', text)
+    # Normalize quotes and dashes in a single pass
+    text = text.translate(_NORMALIZE_TABLE)
     
     return text.strip()
 
-def chunk_text(text: str, book_name: str) -> List[Dict]:
+def _header_offsets(lines: List[str], line_tokens: List[List[int]]) -> Tuple[List[int], List[Tuple[str, str]]]:
     """
-    Break text into smaller, overlapping chunks with metadata.
+    Find chapter/section headers and the token offsets where they start.
     
     Args:
-        text: Full text to chunk
-        book_name: Name of the source textbook
+        lines: Cleaned, non-empty lines of the book
+        line_tokens: Token IDs for each line, as concatenated into the book's token stream
         
     Returns:
-        List[Dict]: List of text chunks with metadata
+        Tuple[List[int], List[Tuple[str, str]]]: Sorted token offsets, and the
+        (chapter, section) in effect from each offset onward
     """
-    clean_text_content = clean_text(text)
-    chunks = []
-    
-    # Split by paragraphs first (double newlines)
-    paragraphs = clean_text_content.split('\n\n')
-    
-    current_chunk = ""
+    offsets = []
+    headings = []
     current_chapter = "Introduction"
     current_section = ""
-    chunk_count = 0
+    position = 0
     
-    for paragraph in paragraphs:
-        paragraph = paragraph.strip()
-        if not paragraph:
-            continue
-            
+    for line, tokens in zip(lines, line_tokens):
+        start = position
+        position += len(tokens)
+        
         # Detect chapter headers (simple heuristic)
-        if (len(paragraph) < 100 and 
-            ('chapter' in paragraph.lower() or 
-             'section' in paragraph.lower() or
-             paragraph.isupper() or
-             re.match(r'^\d+\.', paragraph))):
-            
-            # Save current chunk if it's substantial
-            if len(current_chunk) >= MIN_CHUNK_SIZE:
-                chunks.append({
-                    "text": current_chunk.strip(),
-                    "metadata": {
-                        "book": book_name,
-                        "chapter": current_chapter,
-                        "section": current_section,
-                        "chunk_id": chunk_count
-                    }
-                })
-                chunk_count += 1
-                current_chunk = ""
-            
-            # Update chapter/section info
-            if 'chapter' in paragraph.lower():
-                current_chapter = paragraph
-                current_section = ""
-            else:
-                current_section = paragraph
-            
+        header_match = _HEADER_RE.match(line) if len(line) < 100 else None
+        upper_header = len(line) < 100 and line.isupper() and not _EXERCISE_RE.match(line)
+        if not (header_match or upper_header):
             continue
         
-        # Check if adding this paragraph would exceed chunk size
-        if len(current_chunk) + len(paragraph) + 2 > CHUNK_SIZE:
-            # Save current chunk if it meets minimum size
-            if len(current_chunk) >= MIN_CHUNK_SIZE:
-                chunks.append({
-                    "text": current_chunk.strip(),
-                    "metadata": {
-                        "book": book_name,
-                        "chapter": current_chapter,
-                        "section": current_section,
-                        "chunk_id": chunk_count
-                    }
-                })
-                chunk_count += 1
-                
-                # Start new chunk with overlap
-                overlap_words = current_chunk.split()[-30:]  # Last 30 words for context
-                current_chunk = " ".join(overlap_words) + "\n\n" + paragraph + "\n\n"
+        page_match = _PAGE_SUFFIX_RE.fullmatch(line)
+        heading = page_match.group('title') if page_match else line
+        
+        if header_match and header_match.group('chapter'):
+            if page_match:
+                # Running header, repeated on every page of the chapter. It
+                # only marks a change of chapter and keeps the current section.
+                if heading == current_chapter:
+                    continue
             else:
-                # Current chunk too small, just add paragraph
-                current_chunk += paragraph + "\n\n"
+                current_section = ""
+            current_chapter = heading
         else:
-            current_chunk += paragraph + "\n\n"
+            current_section = heading
+        offsets.append(start)
+        headings.append((current_chapter, current_section))
+    
+    return offsets, headings
+
+def _decode_window(window: List[int]) -> str:
+    """
+    Decode a window of token IDs, dropping characters split at its edges.
+    
+    A window can start or end partway through a multi-byte character, whose
+    bytes span two tokens. Those partial bytes are dropped, rather than being
+    decoded into replacement characters.
+    
+    Args:
+        window: Contiguous slice of the book's token IDs
+        
+    Returns:
+        str: Decoded text of the window
+    """
+    return _ENC.decode_bytes(window).decode('utf-8', errors='ignore').strip()
+
+def chunk_text(text: str, book_name: str) -> Iterator[Dict]:
+    """
+    Break text into overlapping, fixed-size token windows with metadata.
+    
+    The book is tokenized once and sliced into windows of CHUNK_TOKENS tokens,
+    each starting CHUNK_TOKENS - CHUNK_OVERLAP_TOKENS after the previous one.
+    Chunks are produced lazily so they can be embedded while the rest of the
+    book is still being decoded.
+    
+    Args:
+        text: Full text to chunk
+        book_name: Name of the source textbook
+        
+    Yields:
+        Dict: Text chunk with metadata
+    """
+    # Clean line by line so header lines can still be recognized
+    lines = [line for line in map(clean_text, text.split('\n')) if line]
+    if not lines:
+        return
+    
+    # Encode once, keeping per-line token counts for header offsets. Each line
+    # after the first carries its joining space, so the concatenated IDs decode
+    # back to the lines joined by single spaces.
+    line_tokens = _ENC.encode_ordinary_batch([lines[0]] + [' ' + line for line in lines[1:]])
+    header_offsets, headings = _header_offsets(lines, line_tokens)
+    ids = [token for tokens in line_tokens for token in tokens]
+    
+    stride = CHUNK_TOKENS - CHUNK_OVERLAP_TOKENS
     
-    # Don't forget the last chunk
-    if len(current_chunk.strip()) >= MIN_CHUNK_SIZE:
-        chunks.append({
-            "text": current_chunk.strip(),
+    for chunk_count, start in enumerate(range(0, len(ids), stride)):
+        window = ids[start:start + CHUNK_TOKENS]
+        
+        # The tail is already covered by the previous window's overlap
+        if start and len(window) <= CHUNK_OVERLAP_TOKENS:
+            break
+        
+        heading = bisect.bisect_right(header_offsets, start) - 1
+        chapter, section = headings[heading] if heading >= 0 else ("Introduction", "")
+        
+        yield {
+            "text": _decode_window(window),
+            "tokens": len(window),
             "metadata": {
                 "book": book_name,
-                "chapter": current_chapter,
-                "section": current_section,
+                "chapter": chapter,
+                "section": section,
                 "chunk_id": chunk_count
             }
-        })
+        }
+
+def count_tokens(chunk: Dict) -> int:
+    """
+    Count the tokens in a chunk's text, caching the result on the chunk.
     
-    # If we still have very few chunks, force split by character count
-    if len(chunks) < 5 and len(clean_text_content) > CHUNK_SIZE * 2:
-        print(f"⚠️  Only {len(chunks)} chunks created, force-splitting by character count...")
-        chunks = []
-        chunk_count = 0
+    Args:
+        chunk: Chunk dictionary with text and metadata
         
-        # Simple character-based chunking as fallback
-        for i in range(0, len(clean_text_content), CHUNK_SIZE - CHUNK_OVERLAP):
-            chunk_text_content = clean_text_content[i:i + CHUNK_SIZE]
-            
-            if len(chunk_text_content) >= MIN_CHUNK_SIZE:
-                chunks.append({
-                    "text": chunk_text_content,
-                    "metadata": {
-                        "book": book_name,
-                        "chapter": f"Section {chunk_count // 10 + 1}",
-                        "section": f"Part {chunk_count % 10 + 1}",
-                        "chunk_id": chunk_count
-                    }
-                })
-                chunk_count += 1
+    Returns:
+        int: Token count for the embedding model
+    """
+    if 'tokens' not in chunk:
+        chunk['tokens'] = len(_ENC.encode(chunk['text']))
+    return chunk['tokens']
+
+def _log_rate_limit_retry(retry_state: RetryCallState) -> None:
+    """Report an upcoming retry after an embeddings request was rate limited."""
+    print(f"⏳ Rate limited, retrying in {retry_state.next_action.sleep:.1f}s...")
+
+@retry(
+    retry=retry_if_exception_type(openai.RateLimitError),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(EMBEDDING_MAX_RETRIES),
+    before_sleep=_log_rate_limit_retry,
+    reraise=True,
+)
+async def _request_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Send one embeddings request, retrying with exponential backoff when rate limited.
     
-    return chunks
+    Args:
+        texts: Texts to embed, already within the per-input token limit
+        
+    Returns:
+        List[List[float]]: Vector embeddings, in the same order as the input texts
+    """
+    response = await _OPENAI_CLIENT.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts,
+        dimensions=EMBEDDING_DIMENSIONS,
+        encoding_format="float"
+    )
+    
+    return [d.embedding for d in response.data]
 
-def create_embedding(text: str) -> List[float]:
+async def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
     """
-    Create an embedding for the given text using OpenAI's API.
+    Create embeddings for a batch of texts with a single OpenAI API request.
     
     Args:
-        text: Text to embed
+        texts: Texts to embed
         
     Returns:
-        List[float]: Vector embedding
+        List[List[float]]: Vector embeddings, in the same order as the input texts
     """
+    safe_texts = []
+    for text in texts:
+        # Every token covers at least one UTF-8 byte, so short texts can't be too long
+        if len(text.encode('utf-8')) > EMBEDDING_MAX_TOKENS:
+            ids = _ENC.encode(text)
+            if len(ids) > EMBEDDING_MAX_TOKENS:
+                print(f"⚠️  Text too long ({len(ids)} tokens), truncating...")
+                # Truncate to safe length
+                text = _ENC.decode(ids[:EMBEDDING_MAX_TOKENS])
+        safe_texts.append(text)
+    
     try:
-        # Safety check: estimate tokens (rough approximation: 1 token ≈ 4 characters)
-        estimated_tokens = len(text) // 4
-        max_tokens = 8000  # Leave some buffer below the 8192 limit
+        return await _request_embeddings(safe_texts)
         
-        if estimated_tokens > max_tokens:
-            print(f"⚠️  Text too long ({estimated_tokens} estimated tokens), truncating...")
-            # Truncate to safe length
-            text = text[:max_tokens * 4]
+    except openai.RateLimitError:
+        print(f"❌ Rate limited after {EMBEDDING_MAX_RETRIES} attempts, giving up on batch")
+        return None
         
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    except Exception as e:
+        print(f"❌ Error creating embeddings: {str(e)}")
+        return None
+
+def token_budgeted_slices(chunks: Iterable[Dict]) -> Iterator[List[Dict]]:
+    """
+    Group chunks into slices that fit within a single embeddings request.
+    
+    Args:
+        chunks: Text chunks with metadata, consumed lazily
         
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text,
-            encoding_format="float"
-        )
+    Yields:
+        List[Dict]: Consecutive chunks whose tokens stay within budget
+    """
+    current_slice = []
+    current_tokens = 0
+    
+    for chunk in chunks:
+        tokens = min(count_tokens(chunk), EMBEDDING_MAX_TOKENS)
         
-        return response.data[0].embedding
+        # Flush before this chunk would cross either request limit
+        if current_slice and (current_tokens + tokens > EMBEDDING_BATCH_TOKEN_BUDGET or
+                              len(current_slice) >= EMBEDDING_BATCH_SIZE):
+            yield current_slice
+            current_slice = []
+            current_tokens = 0
         
-    except Exception as e:
-        print(f"❌ Error creating embedding: {str(e)}")
-        return None
+        current_slice.append(chunk)
+        current_tokens += tokens
+    
+    if current_slice:
+        yield current_slice
 
-def generate_chunk_id(chunk: Dict) -> str:
+def assign_chunk_ids(chunks: List[Dict]):
     """
-    Generate a unique ID for a chunk based on its content and metadata.
+    Generate a unique ID for each chunk based on its content and metadata.
+    
+    The IDs are stored on the chunks under 'id'.
     
     Args:
-        chunk: Chunk dictionary with text and metadata
+        chunks: Chunk dictionaries with text and metadata
+    """
+    contents = [
+        f"{c['metadata']['book']}_{c['metadata']['chunk_id']}_{c['text'][:100]}".encode()
+        for c in chunks
+    ]
+    digests = [blake3(content).hexdigest(length=16) for content in contents]
+    
+    for chunk, digest in zip(chunks, digests):
+        chunk['id'] = digest
+
+async def _embed_chunks_async(chunks: Iterable[Dict]) -> List[Dict]:
+    """
+    Embed chunks as they are produced, with bounded concurrency, and build Pinecone vectors.
+    
+    Args:
+        chunks: Text chunks with metadata, consumed lazily
         
     Returns:
-        str: Unique chunk ID
+        List[Dict]: Vectors ready for upserting, skipping slices that failed
     """
-    content = f"{chunk['metadata']['book']}_{chunk['metadata']['chunk_id']}_{chunk['text'][:100]}"
-    return hashlib.md5(content.encode()).hexdigest()
+    semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+    progress = tqdm(desc="Creating embeddings", unit="chunk")
+    
+    async def embed_slice(chunk_slice: List[Dict]) -> List[Dict]:
+        async with semaphore:
+            embeddings = await create_embeddings_batch([c['text'] for c in chunk_slice])
+        progress.update(len(chunk_slice))
+        if embeddings is None:
+            return []
+        
+        # Prepare vectors for Pinecone
+        return [
+            {
+                "id": chunk['id'],
+                "values": embedding,
+                "metadata": {
+                    **chunk['metadata'],
+                    "text": chunk['text'][:1000]  # Truncate text for metadata storage
+                }
+            }
+            for chunk, embedding in zip(chunk_slice, embeddings)
+        ]
+    
+    # Submit each slice as soon as it is full so requests overlap with chunking
+    tasks = []
+    for chunk_slice in token_budgeted_slices(chunks):
+        # IDs are hashed for the whole slice up front, outside the per-vector loop
+        assign_chunk_ids(chunk_slice)
+        tasks.append(asyncio.create_task(embed_slice(chunk_slice)))
+        # Give in-flight requests a chance to progress
+        await asyncio.sleep(0)
+    
+    results = await asyncio.gather(*tasks)
+    progress.close()
+    
+    return [vector for slice_vectors in results for vector in slice_vectors]
 
-def upsert_to_pinecone(chunks: List[Dict]) -> bool:
+def upsert_to_pinecone(chunks: Iterable[Dict]) -> bool:
     """
     Upload chunks with embeddings to Pinecone.
     
     Args:
-        chunks: List of text chunks with metadata
+        chunks: Text chunks with metadata, consumed lazily
         
     Returns:
         bool: True if successful
     """
     try:
-        print(f"🌲 Connecting to Pinecone...")
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        index = pc.Index(PINECONE_INDEX_NAME)
+        index = get_pinecone_index()
         
-        # Process chunks in batches
-        batch_size = 100
-        total_chunks = len(chunks)
+        # Create embeddings concurrently, one request per token-budgeted slice
+        vectors = _EVENT_LOOP.run_until_complete(_embed_chunks_async(chunks))
+        print(f"📦 Embedded {len(vectors)} chunks")
         
-        for i in range(0, total_chunks, batch_size):
-            batch = chunks[i:i + batch_size]
-            vectors = []
-            
-            print(f"📊 Processing batch {i//batch_size + 1}/{(total_chunks-1)//batch_size + 1}...")
-            
-            for chunk in tqdm(batch, desc="Creating embeddings"):
-                # Create embedding
-                embedding = create_embedding(chunk['text'])
-                if embedding is None:
-                    continue
-                
-                # Prepare vector for Pinecone
-                vector_id = generate_chunk_id(chunk)
-                vectors.append({
-                    "id": vector_id,
-                    "values": embedding,
-                    "metadata": {
-                        **chunk['metadata'],
-                        "text": chunk['text'][:1000]  # Truncate text for metadata storage
-                    }
-                })
-                
-                # Rate limiting for OpenAI API
-                time.sleep(0.1)
-            
-            # Upsert batch to Pinecone
-            if vectors:
-                print(f"🚀 Upserting {len(vectors)} vectors to Pinecone...")
-                index.upsert(vectors=vectors)
-                print(f"✅ Successfully upserted batch")
+        # Upsert to Pinecone in concurrent batches
+        batches = [vectors[i:i + PINECONE_BATCH_SIZE] for i in range(0, len(vectors), PINECONE_BATCH_SIZE)]
+        print(f"🚀 Upserting {len(vectors)} vectors to Pinecone in {len(batches)} batches...")
+        
+        futures = [index.upsert(vectors=batch, async_req=True) for batch in batches]
+        for future in futures:
+            future.get()
+        
+        print(f"✅ Successfully upserted {len(batches)} batches")
         
         # Get index stats
         stats = index.describe_index_stats()
@@ -431,22 +719,24 @@ def process_textbook_to_embeddings(book_name: str) -> bool:
     try:
         print(f"\n🔄 Processing {book_name} for embeddings...")
         
-        # Read the text file
-        with open(text_path, 'r', encoding='utf-8') as file:
-            text = file.read()
+        # Read the text file, decoding straight from a memory map
+        if os.path.getsize(text_path) == 0:
+            text = ""
+        else:
+            with open(text_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, 'utf-8')
         
         print(f"📚 Text loaded: {len(text):,} characters")
         
-        # Chunk the text
-        print(f"✂️  Chunking text...")
+        # Chunk the text, streaming chunks into the embedder as they are produced
+        print(f"✂️  Chunking and embedding text...")
         chunks = chunk_text(text, book_name)
-        print(f"📦 Created {len(chunks)} chunks")
         
         # Create embeddings and upsert to Pinecone
         success = upsert_to_pinecone(chunks)
         
         if success:
-            print(f"✅ Successfully processed {book_name} ({len(chunks)} chunks)")
+            print(f"✅ Successfully processed {book_name}")
         else:
             print(f"❌ Failed to process {book_name}")
             
@@ -477,10 +767,9 @@ def main():
     
     # Phase 1: Download PDFs (if needed)
     print("\n📥 PHASE 1: Downloading PDFs...")
-    download_count = 0
-    for book_name, url in TEXTBOOK_URLS.items():
-        if download_pdf(book_name, url):
-            download_count += 1
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        results = list(executor.map(lambda item: download_pdf(*item), TEXTBOOK_URLS.items()))
+    download_count = sum(results)
     
     print(f"📊 Downloaded/Verified {download_count} PDFs")
     
@@ -510,15 +799,14 @@ def main():
     print(f"📚 Processed {processed_count} textbooks into vector embeddings")
     print("🔍 Your RAG knowledge base is ready for queries!")
     
-    # Calculate total characters processed
-    total_chars = 0
+    # Calculate total content processed (bytes ≈ characters for mostly-ASCII text)
+    total_bytes = 0
     for book_name in TEXTBOOK_URLS.keys():
         text_path = os.path.join(BASE_DIR, book_name, f"{book_name}_full_text.txt")
         if os.path.exists(text_path):
-            with open(text_path, 'r', encoding='utf-8') as file:
-                total_chars += len(file.read())
+            total_bytes += os.path.getsize(text_path)
     
-    print(f"📊 Total content: {total_chars:,} characters")
+    print(f"📊 Total content: {total_bytes:,} bytes")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -3,7 +3,7 @@ Test script to verify chunking algorithm works correctly.
 """
 import os
 from dotenv import load_dotenv
-from ingest import chunk_text, clean_text
+from ingest import CHUNK_TOKENS, chunk_text, clean_text
 
 load_dotenv()
 
@@ -27,7 +27,7 @@ def test_chunking():
     print(f"📚 Original text: {len(text):,} characters")
     
     # Chunk the text
-    chunks = chunk_text(text, book_name)
+    chunks = list(chunk_text(text, book_name))
     
     print(f"📦 Created {len(chunks)} chunks")
     
@@ -41,9 +41,9 @@ def test_chunking():
     print(f"   - Total: {sum(chunk_sizes):,} chars")
     
     # Check for oversized chunks
-    oversized = [size for size in chunk_sizes if size > 8000]
+    oversized = [chunk for chunk in chunks if chunk['tokens'] > CHUNK_TOKENS]
     if oversized:
-        print(f"⚠️  Found {len(oversized)} oversized chunks (>8000 chars)")
+        print(f"⚠️  Found {len(oversized)} oversized chunks (>{CHUNK_TOKENS} tokens)")
     else:
         print(f"✅ All chunks are appropriately sized")
     
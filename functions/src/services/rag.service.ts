@@ -72,6 +72,7 @@ async function createEmbedding(text: string): Promise<number[]> {
     const response = await openai.embeddings.create({
       model: 'text-embedding-3-small',
       input: text,
+      dimensions: 768, // Must match the dimensions used at ingestion
       encoding_format: 'float',
     });
 